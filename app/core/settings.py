@@ -11,15 +11,33 @@ class Settings(BaseSettings):
     PG_DB: str = "fotoscdo"
     PG_USER: str = "postgres"
     PG_PASSWORD: str = "postgres"
+    PG_POOL_SIZE: int = 20
+    PG_MAX_OVERFLOW: int = 10
+    PG_POOL_TIMEOUT: int = 30
+    PG_POOL_RECYCLE: int = 1800
+    # Si se conecta vía PgBouncer, dejar el pooling a PgBouncer (NullPool)
+    PG_USE_PGBOUNCER: bool = False
 
     SFTP_HOST: str = "localhost"
     SFTP_PORT: int = 2222
     SFTP_USER: str = "pablo"
     SFTP_PASSWORD: str = "pablo"
     SFTP_BASE_PATH: str = "/upload"
+    SFTP_POOL_SIZE: int = 4
+
+    # Object storage (S3/MinIO) para los binarios de las fotos
+    S3_ENDPOINT: str = "localhost:9000"
+    S3_ACCESS_KEY: str = "minioadmin"
+    S3_SECRET_KEY: str = "minioadmin"
+    S3_BUCKET: str = "fotoscdo"
+    S3_REGION: str = "us-east-1"
+    S3_SECURE: bool = False
+    S3_PRESIGN_EXPIRES_S: int = 3600
 
     MAX_IMAGE_SIZE_BYTES: int = 1_048_576
+    IMAGE_DRAFT_MIN_PX: int = 2048  # lado mínimo al decodificar JPEG con draft (escala DCT 1/2, 1/4, 1/8)
     DEFAULT_SEARCH_RADIUS_M: int = 200
+    SEARCH_MAX_RESULTS: int = 500
 
     ENABLE_OTEL: bool = False
     OTEL_EXPORTER_OTLP_ENDPOINT: str = "http://localhost:4317"
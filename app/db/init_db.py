@@ -2,8 +2,8 @@ from sqlalchemy import text
 from app.db.session import engine
 from app.db.models import Base
 
-def init_db():
-    with engine.begin() as conn:
+async def init_db():
+    async with engine.begin() as conn:
         # Habilitar extensión PostGIS si no existe
-        conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
-        Base.metadata.create_all(bind=conn)
\ No newline at end of file
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+        await conn.run_sync(Base.metadata.create_all)
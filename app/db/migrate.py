@@ -0,0 +1,116 @@
+"""
+Migración de bases existentes al esquema actual (create_all no altera tablas ya creadas).
+
+    python -m app.db.migrate
+
+- Agrega photos.storage_key
+- Si todavía existe photos.data: sube cada binario a object storage como <id>.jpg y completa storage_key
+- Deja storage_key NOT NULL y elimina photos.data
+- Pasa exif de JSON a JSONB y crea los índices de Photo que falten (reemplaza ix_photos_cdo
+  y recrea ix_photos_cdo_captured con el orden de /photos/search)
+
+Es idempotente: se puede volver a correr si se corta a mitad del backfill.
+"""
+import asyncio
+import logging
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from app.db.init_db import init_db
+from app.db.models import Photo
+from app.db.session import engine
+from app.services.object_storage import get_object_storage
+
+logger = logging.getLogger("app.migrate")
+
+BACKFILL_BATCH = 100
+
+
+async def _column_type(conn, table: str, column: str) -> str | None:
+    """data_type de information_schema, o None si la columna no existe."""
+    res = await conn.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :t AND column_name = :c"
+        ),
+        {"t": table, "c": column},
+    )
+    return res.scalar_one_or_none()
+
+
+def _create_photo_indexes(sync_conn) -> None:
+    for index in Photo.__table__.indexes:
+        index.create(sync_conn, checkfirst=True)
+
+
+async def _backfill_storage_keys() -> int:
+    """Sube photos.data a object storage por lotes; cada lote commitea sus claves."""
+    storage = get_object_storage()
+    total = 0
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                text(
+                    "SELECT id, data, mime_type FROM photos "
+                    "WHERE storage_key IS NULL AND data IS NOT NULL ORDER BY id LIMIT :n"
+                ),
+                {"n": BACKFILL_BATCH},
+            )).all()
+            if not rows:
+                return total
+            for photo_id, data, mime in rows:
+                key = f"{photo_id}.jpg"
+                await run_in_threadpool(storage.put_bytes, key, bytes(data), mime or "image/jpeg")
+                await conn.execute(
+                    text("UPDATE photos SET storage_key = :k WHERE id = :id"),
+                    {"k": key, "id": photo_id},
+                )
+        total += len(rows)
+        logger.info("Backfill storage_key | subidas=%d", total)
+
+
+async def migrate() -> None:
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE photos ADD COLUMN IF NOT EXISTS storage_key VARCHAR"))
+        has_data = await _column_type(conn, "photos", "data") is not None
+
+    if has_data:
+        await run_in_threadpool(get_object_storage().ensure_bucket)
+        n = await _backfill_storage_keys()
+        logger.info("Backfill terminado | filas=%d", n)
+
+    async with engine.begin() as conn:
+        missing = (await conn.execute(
+            text("SELECT count(*) FROM photos WHERE storage_key IS NULL")
+        )).scalar_one()
+        if missing:
+            raise RuntimeError(f"{missing} fotos sin storage_key ni data: revisar a mano antes de seguir")
+        await conn.execute(text("ALTER TABLE photos ALTER COLUMN storage_key SET NOT NULL"))
+        await conn.execute(text("ALTER TABLE photos DROP COLUMN IF EXISTS data"))
+
+        if await _column_type(conn, "photos", "exif") == "json":
+            await conn.execute(text("ALTER TABLE photos ALTER COLUMN exif TYPE JSONB USING exif::jsonb"))
+        # El índice simple por cdo queda cubierto por (cdo, captured_at)
+        await conn.execute(text("DROP INDEX IF EXISTS ix_photos_cdo"))
+        # ix_photos_cdo_captured cambió de definición: checkfirst solo mira el nombre, se recrea a mano
+        indexdef = (await conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND indexname = :n"),
+            {"n": "ix_photos_cdo_captured"},
+        )).scalar_one_or_none()
+        if indexdef and "NULLS LAST" not in indexdef:
+            await conn.execute(text("DROP INDEX ix_photos_cdo_captured"))
+        await conn.run_sync(_create_photo_indexes)
+    logger.info("Migración photos lista (storage_key NOT NULL, sin data, exif JSONB, índices)")
+
+
+async def main() -> None:
+    try:
+        # Crea lo que falte (ingest_jobs, índices nuevos de tablas nuevas) antes de alterar photos
+        await init_db()
+        await migrate()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    asyncio.run(main())
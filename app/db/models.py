@@ -1,6 +1,7 @@
 import uuid
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, JSON, LargeBinary, DateTime
+from sqlalchemy import String, Integer, DateTime, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from geoalchemy2 import Geography
 
@@ -9,23 +10,56 @@ class Base(DeclarativeBase):
 
 class Photo(Base):
     __tablename__ = "photos"
+    __table_args__ = (
+        # GIN sobre exif para consultas por tag (exif @> '{"0th.Make": "Apple"}')
+        Index("ix_photos_exif_gin", "exif", postgresql_using="gin"),
+    )
 
     id: Mapped[str] = mapped_column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    cdo: Mapped[str] = mapped_column(String, index=True)
+    cdo: Mapped[str] = mapped_column(String)
 
     # Coordenadas en WGS84 (lon/lat) como Geography(Point)
-    geom: Mapped[object] = mapped_column(Geography(geometry_type="POINT", srid=4326), nullable=False)
+    # spatial_index=True -> índice GiST para que ST_DWithin use preselección por bbox
+    geom: Mapped[object] = mapped_column(
+        Geography(geometry_type="POINT", srid=4326, spatial_index=True), nullable=False
+    )
 
     mime_type: Mapped[str] = mapped_column(String)
     size_bytes: Mapped[int] = mapped_column(Integer)
     width: Mapped[int] = mapped_column(Integer)
     height: Mapped[int] = mapped_column(Integer)
-    exif: Mapped[dict] = mapped_column(JSON)
+    exif: Mapped[dict] = mapped_column(JSONB)
 
-    data: Mapped[bytes] = mapped_column(LargeBinary)
+    # Clave del objeto en S3/MinIO (el binario no vive en Postgres)
+    storage_key: Mapped[str] = mapped_column(String, nullable=False)
 
     # NUEVO: fecha/hora de captura extraída del EXIF (puede ser nula)
     captured_at: Mapped[object] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
 
     # Fecha de inserción del registro
     created_at: Mapped[object] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+# Búsqueda por CDO: mismo orden que /photos/search (captured_at DESC NULLS LAST, id),
+# así el LIMIT sale del índice sin sort; sirve también para cdo = :cdo solo
+Index("ix_photos_cdo_captured", Photo.cdo, Photo.captured_at.desc().nullslast(), Photo.id)
+
+
+class IngestJob(Base):
+    """Estado de una ingesta SFTP encolada (POST /photos/ingest/sftp -> 202)."""
+    __tablename__ = "ingest_jobs"
+
+    id: Mapped[str] = mapped_column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    # pending | running | done | error
+    status: Mapped[str] = mapped_column(String, default="pending")
+    cdo: Mapped[str] = mapped_column(String)
+    path: Mapped[str] = mapped_column(String)
+
+    # Resultado: id de la foto creada, o mensaje de error
+    photo_id: Mapped[str] = mapped_column(String, nullable=True)
+    error: Mapped[str] = mapped_column(String, nullable=True)
+
+    created_at: Mapped[object] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
@@ -1,13 +1,26 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 from app.core.settings import get_settings
 
 settings = get_settings()
 
+# psycopg 3 expone driver asyncio nativo: el mismo URL sirve para el engine async
 DB_URL = (
     f"postgresql+psycopg://{settings.PG_USER}:{settings.PG_PASSWORD}"
     f"@{settings.PG_HOST}:{settings.PG_PORT}/{settings.PG_DB}"
 )
 
-engine = create_engine(DB_URL, pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+if settings.PG_USE_PGBOUNCER:
+    # PgBouncer ya hace pooling: no mantener conexiones propias
+    pool_kwargs = {"poolclass": NullPool}
+else:
+    pool_kwargs = {
+        "pool_size": settings.PG_POOL_SIZE,
+        "max_overflow": settings.PG_MAX_OVERFLOW,
+        "pool_timeout": settings.PG_POOL_TIMEOUT,
+        "pool_recycle": settings.PG_POOL_RECYCLE,
+    }
+
+# query_cache_size: más entradas en el cache de SQL compilado (default 500)
+engine = create_async_engine(DB_URL, pool_pre_ping=True, query_cache_size=1200, **pool_kwargs)
+AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
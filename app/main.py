@@ -1,9 +1,14 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.settings import get_settings
 from app.db.init_db import init_db
+from app.db.session import engine
 from app.middleware.request_context import RequestContextMiddleware
 from app.routers import photos, health
+from app.services.sftp_client import get_sftp_client
+from app.services.object_storage import get_object_storage
+from starlette.concurrency import run_in_threadpool
 
 # OpenTelemetry (opcional)
 from opentelemetry import trace
@@ -20,11 +25,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger("app")
 
-app = FastAPI(title="FotosCDO API")
-app.add_middleware(RequestContextMiddleware)
 
-# Init DB + PostGIS
-init_db()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Init DB + PostGIS + bucket de fotos
+    await init_db()
+    await run_in_threadpool(get_object_storage().ensure_bucket)
+    yield
+    get_sftp_client().close()
+    await engine.dispose()
+
+
+app = FastAPI(title="FotosCDO API", lifespan=lifespan)
+app.add_middleware(RequestContextMiddleware)
 
 # Instrumentación OTEL si está habilitada
 if settings.ENABLE_OTEL:
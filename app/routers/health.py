@@ -1,30 +1,38 @@
 import logging
 from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy import text
 from app.db.session import engine
-from app.services.sftp_client import SFTPClient
+from app.services.sftp_client import get_sftp_client
+from app.services.object_storage import get_object_storage
 
 router = APIRouter(prefix="/health", tags=["Health"])
 logger = logging.getLogger(__name__)
 
 @router.get("")
 async def health():
-    status = {"database": False, "sftp": False, "status": "fail"}
+    status = {"database": False, "sftp": False, "storage": False, "status": "fail"}
 
     # DB
     try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
         status["database"] = True
     except Exception as e:
         logger.error("DB error: %s", e)
 
     # SFTP
     try:
-        ok = SFTPClient().healthy()
+        ok = await run_in_threadpool(get_sftp_client().healthy)
         status["sftp"] = ok
     except Exception as e:
         logger.error("SFTP error: %s", e)
 
-    status["status"] = "ok" if status["database"] and status["sftp"] else "fail"
+    # Object storage
+    try:
+        status["storage"] = await run_in_threadpool(get_object_storage().healthy)
+    except Exception as e:
+        logger.error("Storage error: %s", e)
+
+    status["status"] = "ok" if status["database"] and status["sftp"] and status["storage"] else "fail"
     return status
\ No newline at end of file
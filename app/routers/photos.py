@@ -1,63 +1,101 @@
 import io
 import logging
-from fastapi.responses import HTMLResponse
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-from geoalchemy2.shape import from_shape, to_shape
+import uuid
+from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Query
+from sqlalchemy import select, insert, func, cast, update
+from geoalchemy2 import Geometry, Geography
+from geoalchemy2.shape import from_shape
 from shapely.geometry import Point
-from app.db.session import SessionLocal
-from app.db.models import Photo
-from app.schemas.photos import IngestBySFTP, PhotoMeta, PhotoSearchResponse
-from app.services.sftp_client import SFTPClient
+from app.db.session import AsyncSessionLocal
+from app.db.models import Photo, IngestJob
+from app.schemas.photos import IngestBySFTP, IngestJobResponse, PhotoMeta, PhotoSearchResponse
+from app.services.sftp_client import get_sftp_client
 from app.services.image_service import ImageService
+from app.services.object_storage import get_object_storage
 from app.core.settings import get_settings
-from starlette.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from opentelemetry.trace import get_current_span
-from PIL import Image
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/photos", tags=["Photos"])
 settings = get_settings()
 
+# Columnas para endpoints de metadata: proyección explícita, sin storage_key ni fechas.
+# lon/lat se proyectan en SQL (ST_X/ST_Y) en vez de parsear WKB con Shapely por fila.
+_GEOM_POINT = cast(Photo.geom, Geometry(geometry_type="POINT", srid=4326))
+_META_COLUMNS = (
+    Photo.id, Photo.cdo,
+    func.ST_X(_GEOM_POINT).label("lon"),
+    func.ST_Y(_GEOM_POINT).label("lat"),
+    Photo.mime_type, Photo.size_bytes, Photo.width, Photo.height, Photo.exif,
+)
 
-@router.post("/ingest/sftp", response_model=PhotoMeta)
-def ingest_sftp(payload: IngestBySFTP):
+
+async def _update_job(job_id: str, **values) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(IngestJob).where(IngestJob.id == job_id).values(**values))
+        await db.commit()
+
+
+async def _run_ingest_job(job_id: str, payload: IngestBySFTP) -> None:
+    """
+    Worker en background: corre la ingesta y deja el resultado en ingest_jobs.
+    Cualquier salida que no sea "done" (incluida la cancelación al apagar) marca el job
+    como "error", para que no quede en pending/running para siempre.
+    """
+    meta = None
+    try:
+        await _update_job(job_id, status="running")
+        meta = await _ingest_sftp(payload)
+        await _update_job(job_id, status="done", photo_id=meta.id)
+    except BaseException as e:
+        logger.warning("Ingest job fallido | job_id=%s err=%r", job_id, e)
+        try:
+            await _update_job(
+                job_id, status="error", error=str(e) or type(e).__name__,
+                photo_id=meta.id if meta else None,
+            )
+        except Exception:
+            logger.exception("No se pudo marcar el job como error | job_id=%s", job_id)
+        if not isinstance(e, Exception):
+            raise  # CancelledError / KeyboardInterrupt siguen su curso
+
+
+async def _ingest_sftp(payload: IngestBySFTP) -> PhotoMeta:
     """
-    Ingesta una foto desde SFTP:
+    Ingesta una foto desde SFTP (la corre _run_ingest_job en background):
+    - Baja el original a un spool (memoria o disco)
     - Comprime a ~1 MB preservando EXIF
-    - Extrae EXIF (aplanado) para guardar
-    - Obtiene lon/lat desde EXIF del archivo original (fallback a comprimida)
-      * Si no hay GPS en EXIF y no vinieron lon/lat manuales -> 400
-    - (Opcional) Captura 'captured_at' si el modelo lo tiene
+    - Parsea EXIF del original una sola vez: aplanado, lon/lat y fecha de captura
+      * lon/lat manuales pisan al GPS del EXIF; si no hay ninguno -> error
+    - Sube el JPEG a object storage e inserta la fila con storage_key y captured_at
     """
     span = get_current_span()
-    sftp = SFTPClient()
+    sftp = get_sftp_client()
     logger.debug("Ingest SFTP | cdo=%s path=%s", payload.cdo, payload.path)
 
     try:
-        raw = sftp.fetch_bytes(payload.path)
-        logger.debug("Bytes originales leídos: %d", len(raw))
+        spool = await run_in_threadpool(sftp.fetch_to_spool, payload.path)
     except Exception as e:
         logger.exception("Error leyendo SFTP")
-        raise HTTPException(status_code=400, detail=f"SFTP error: {e}")
+        raise ValueError(f"SFTP error: {e}")
 
-    # Comprimir a ~1MB, preservando EXIF si existía
-    img_bytes, w, h, mime = ImageService.compress_to_target_jpeg(
-        raw, settings.MAX_IMAGE_SIZE_BYTES
-    )
-    logger.debug("Bytes comprimidos: %d, mime=%s, size=%sx%s", len(img_bytes), mime, w, h)
+    # El original vive en el spool (memoria o disco); PIL y exifread lo leen por seek
+    with spool:
+        size = spool.seek(0, io.SEEK_END)
+        spool.seek(0)
+        logger.debug("Bytes originales leídos: %d", size)
 
-    # Abrir la imagen comprimida para EXIF legible (para respuesta/guardado)
-    pil_img = Image.open(io.BytesIO(img_bytes))
-
-    # EXIF (aplanado) para guardar/retornar
-    exif = ImageService.extract_exif(pil_img)
-    logger.debug("EXIF extraído (aplanado) | keys=%d", len(exif.keys()) if exif else 0)
+        # Comprimir a ~1MB, preservando EXIF si existía
+        img_bytes, w, h, mime = await run_in_threadpool(
+            ImageService.compress_to_target_jpeg, spool, settings.MAX_IMAGE_SIZE_BYTES
+        )
+        logger.debug("Bytes comprimidos: %d, mime=%s, size=%sx%s", len(img_bytes), mime, w, h)
 
-    # GPS: primero desde el ORIGINAL (fallback a EXIF de la comprimida)
-    gps = ImageService.extract_gps_from_original(original_bytes=raw, compressed_img=pil_img)
-    captured_at = ImageService.extract_captured_at(pil_img, original_bytes=raw)
+        # EXIF del original parseado una sola vez -> aplanado + GPS + fecha
+        parsed = await run_in_threadpool(ImageService.parse_once, spool)
+    exif, gps, captured_at = parsed.exif, parsed.gps, parsed.captured_at
     logger.debug("GPS extraído=%s | captured_at=%s", gps, captured_at)
 
     # Resolver coordenadas: override manual > EXIF > error
@@ -69,118 +107,160 @@ def ingest_sftp(payload: IngestBySFTP):
             logger.info("GPS resuelto desde EXIF | lon=%.6f lat=%.6f", lon, lat)
         else:
             logger.warning("La foto no tiene GPS detectable en EXIF (ni original ni comprimida)")
-            raise HTTPException(
-                status_code=400,
-                detail="La foto no tiene GPS en EXIF. Enviá lon/lat para este caso."
-            )
+            raise ValueError("La foto no tiene GPS en EXIF. Enviá lon/lat para este caso.")
 
     geom = from_shape(Point(lon, lat), srid=4326)
 
-    with SessionLocal() as db:
-        photo = Photo(
-            cdo=payload.cdo,
-            geom=geom,
-            mime_type=mime,
-            size_bytes=len(img_bytes),
-            width=w,
-            height=h,
-            exif=exif,
-            data=img_bytes,
-            # si tu modelo tiene esta columna:
-            captured_at=captured_at,
-        )
-        db.add(photo)
-        db.commit()
-        db.refresh(photo)
-
-        logger.info(
-            "Foto almacenada | id=%s cdo=%s lon=%.6f lat=%.6f size=%sB trace_id=%s",
-            photo.id, payload.cdo, lon, lat, len(img_bytes),
-            (format(span.get_span_context().trace_id, '032x') if span else None),
-        )
+    # El binario va a object storage; en la fila queda solo la clave
+    photo_id = str(uuid.uuid4())
+    storage_key = f"{photo_id}.jpg"
+    storage = get_object_storage()
+    await run_in_threadpool(storage.put_bytes, storage_key, img_bytes, mime)
+
+    # Un solo INSERT (sin add/refresh); el id se genera acá, no hace falta RETURNING
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                insert(Photo)
+                .values(
+                    id=photo_id,
+                    cdo=payload.cdo,
+                    geom=geom,
+                    mime_type=mime,
+                    size_bytes=len(img_bytes),
+                    width=w,
+                    height=h,
+                    exif=exif,
+                    storage_key=storage_key,
+                    captured_at=captured_at,
+                )
+            )
+            await db.commit()
+    except BaseException:
+        # Sin fila el objeto queda huérfano: se borra (best-effort) y se propaga el error
+        try:
+            await run_in_threadpool(storage.delete, storage_key)
+        except Exception:
+            logger.warning("No se pudo borrar el objeto huérfano | key=%s", storage_key, exc_info=True)
+        raise
 
-        return PhotoMeta(
-            id=photo.id,
-            cdo=photo.cdo,
-            lon=lon,
-            lat=lat,
-            mime_type=photo.mime_type,
-            size_bytes=photo.size_bytes,
-            width=photo.width,
-            height=photo.height,
-            exif=photo.exif,
-            # si expusiste estos campos en el schema:
-            # captured_at=photo.captured_at,
-            # created_at=photo.created_at,
+    logger.info(
+        "Foto almacenada | id=%s cdo=%s lon=%.6f lat=%.6f size=%sB trace_id=%s",
+        photo_id, payload.cdo, lon, lat, len(img_bytes),
+        (format(span.get_span_context().trace_id, '032x') if span else None),
+    )
+
+    return PhotoMeta(
+        id=photo_id,
+        cdo=payload.cdo,
+        lon=lon,
+        lat=lat,
+        mime_type=mime,
+        size_bytes=len(img_bytes),
+        width=w,
+        height=h,
+        exif=exif,
+    )
+
+
+@router.post("/ingest/sftp", response_model=IngestJobResponse, status_code=202)
+async def ingest_sftp(payload: IngestBySFTP, background_tasks: BackgroundTasks):
+    """
+    Encola la ingesta desde SFTP y responde 202 con el job_id.
+    El estado/resultado se consulta en GET /photos/ingest/{job_id}.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            insert(IngestJob)
+            .values(status="pending", cdo=payload.cdo, path=payload.path)
+            .returning(IngestJob.id, IngestJob.status)
         )
+        job_id, status = result.one()
+        await db.commit()
+
+    logger.debug("Ingest encolada | job_id=%s cdo=%s path=%s", job_id, payload.cdo, payload.path)
+    background_tasks.add_task(_run_ingest_job, job_id, payload)
+    return IngestJobResponse(job_id=job_id, status=status)
+
+
+@router.get("/ingest/{job_id}", response_model=IngestJobResponse)
+async def get_ingest_job(job_id: str):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(IngestJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="No existe")
+        photo = None
+        if job.photo_id:
+            row = (await db.execute(select(*_META_COLUMNS).where(Photo.id == job.photo_id))).first()
+            photo = PhotoMeta(**row._mapping) if row else None
+    return IngestJobResponse(job_id=job.id, status=job.status, photo=photo, error=job.error)
 
 
 @router.get("/search", response_model=PhotoSearchResponse)
-def search(cdo: str | None = None, lon: float | None = None, lat: float | None = None, radius_m: int | None = None):
+async def search(
+    cdo: str | None = None,
+    lon: float | None = None,
+    lat: float | None = None,
+    radius_m: int | None = None,
+    limit: int | None = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+):
     if not cdo and (lon is None or lat is None):
         raise HTTPException(status_code=400, detail="Debe enviar cdo o lon/lat")
 
     r = radius_m or settings.DEFAULT_SEARCH_RADIUS_M
-    logger.debug("Search | cdo=%s lon=%s lat=%s r=%s", cdo, lon, lat, r)
+    n = min(limit or settings.SEARCH_MAX_RESULTS, settings.SEARCH_MAX_RESULTS)
+    logger.debug("Search | cdo=%s lon=%s lat=%s r=%s limit=%s offset=%s", cdo, lon, lat, r, n, offset)
 
-    items = []
-    with SessionLocal() as db:
+    async with AsyncSessionLocal() as db:
         if cdo:
-            rows = db.query(Photo).filter(Photo.cdo == cdo).all()
+            # Más recientes primero (sin fecha al final); coincide con ix_photos_cdo_captured,
+            # así el LIMIT sale del índice sin sort externo
+            stmt = (
+                select(*_META_COLUMNS)
+                .where(Photo.cdo == cdo)
+                .order_by(Photo.captured_at.desc().nullslast(), Photo.id)
+            )
         else:
-            # Consulta espacial (ST_DWithin con Geography, metros)
-            q = db.query(Photo).filter(
-                text("ST_DWithin(geom, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :r)")
-            ).params(lon=lon, lat=lat, r=r)
-            rows = q.all()
-
-        for p in rows:
-            pt = to_shape(p.geom)
-            items.append(
-                PhotoMeta(
-                    id=p.id,
-                    cdo=p.cdo,
-                    lon=pt.x,
-                    lat=pt.y,
-                    mime_type=p.mime_type,
-                    size_bytes=p.size_bytes,
-                    width=p.width,
-                    height=p.height,
-                    exif=p.exif,
-                    # captured_at=p.captured_at,
-                    # created_at=p.created_at,
-                )
+            # Consulta espacial (ST_DWithin con Geography, metros); usa el índice GiST de geom
+            point = cast(func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326), Geography(srid=4326))
+            stmt = (
+                select(*_META_COLUMNS)
+                .where(func.ST_DWithin(Photo.geom, point, r))
+                .order_by(func.ST_Distance(Photo.geom, point), Photo.id)
             )
-    return PhotoSearchResponse(items=items)
+        # Una fila de más para saber si hay otra página
+        stmt = stmt.offset(offset).limit(n + 1)
+        rows = (await db.execute(stmt)).all()
+
+    truncated = len(rows) > n
+    items = [PhotoMeta(**row._mapping) for row in rows[:n]]
+    return PhotoSearchResponse(
+        items=items,
+        truncated=truncated,
+        next_offset=offset + n if truncated else None,
+    )
 
 
 @router.get("/{photo_id}/image")
-def get_image(photo_id: str):
-    with SessionLocal() as db:
-        p = db.get(Photo, photo_id)
-        if not p:
-            raise HTTPException(status_code=404, detail="No existe")
-        filename = f"{p.cdo}_{photo_id}.jpg"
-        return StreamingResponse(
-            io.BytesIO(p.data),
-            media_type=p.mime_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"; filename*=UTF-8\'\'{filename}',
-                "Cache-Control": "public, max-age=31536000, immutable",
-            },
-        )
+async def get_image(photo_id: str):
+    async with AsyncSessionLocal() as db:
+        stmt = select(Photo.storage_key, Photo.cdo).where(Photo.id == photo_id)
+        p = (await db.execute(stmt)).first()
+    if not p:
+        raise HTTPException(status_code=404, detail="No existe")
+    # Redirect a URL firmada: los bytes salen directo de S3/MinIO, no pasan por la API
+    filename = f"{p.cdo}_{photo_id}.jpg"
+    url = get_object_storage().presigned_url(p.storage_key, filename)
+    return RedirectResponse(url, status_code=307)
 
 
 @router.get("/{photo_id}", response_model=PhotoMeta)
-def get_meta(photo_id: str):
-    with SessionLocal() as db:
-        p = db.get(Photo, photo_id)
-        if not p:
+async def get_meta(photo_id: str):
+    async with AsyncSessionLocal() as db:
+        stmt = select(*_META_COLUMNS).where(Photo.id == photo_id)
+        row = (await db.execute(stmt)).first()
+        if not row:
             raise HTTPException(status_code=404, detail="No existe")
-        pt = to_shape(p.geom)
-        return PhotoMeta(
-            id=p.id, cdo=p.cdo, lon=pt.x, lat=pt.y,
-            mime_type=p.mime_type, size_bytes=p.size_bytes,
-            width=p.width, height=p.height, exif=p.exif
-        )
+        return PhotoMeta(**row._mapping)
 
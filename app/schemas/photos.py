@@ -32,4 +32,13 @@ class SearchByGeo(BaseModel):
     radius_m: int = 200
 
 class PhotoSearchResponse(BaseModel):
-    items: List[PhotoMeta]
\ No newline at end of file
+    items: List[PhotoMeta]
+    # Hay más resultados: pedir la página siguiente con offset=next_offset
+    truncated: bool = False
+    next_offset: Optional[int] = None
+
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="pending | running | done | error")
+    photo: Optional[PhotoMeta] = None
+    error: Optional[str] = None
@@ -1,7 +1,8 @@
 import io
 import logging
 import re
-from typing import Tuple, Dict, Optional
+from dataclasses import dataclass, field
+from typing import BinaryIO, Tuple, Dict, Optional
 from datetime import datetime, timezone
 from xml.etree import ElementTree as ET
 
@@ -20,42 +21,106 @@ from app.core.settings import get_settings
 settings = get_settings()
 logger = logging.getLogger("app")
 
+# El paquete XMP de un JPEG va en APP1, dentro de los primeros KB
+XMP_HEAD_BYTES = 256 * 1024
+
+# Tags EXIF que se persisten (el resto -MakerNote, thumbnails, offsets- infla la fila)
+EXIF_WANTED_TAGS = frozenset({
+    "Make", "Model", "Software", "Orientation", "DateTime",
+    "DateTimeOriginal", "DateTimeDigitized", "OffsetTimeOriginal",
+    "ExposureTime", "FNumber", "ISOSpeedRatings", "FocalLength", "FocalLengthIn35mmFilm",
+    "LensMake", "LensModel", "Flash", "WhiteBalance", "PixelXDimension", "PixelYDimension",
+    "GPSLatitudeRef", "GPSLatitude", "GPSLongitudeRef", "GPSLongitude",
+    "GPSAltitudeRef", "GPSAltitude", "GPSImgDirection", "GPSDateStamp", "GPSTimeStamp",
+})
+
+
+@dataclass
+class ParsedExif:
+    """Resultado de una única pasada de parseo EXIF sobre el archivo original."""
+    exif: Dict[str, str] = field(default_factory=dict)  # aplanado, para guardar/retornar
+    gps: Optional[Tuple[float, float]] = None  # (lon, lat)
+    captured_at: Optional[datetime] = None
+
 
 class ImageService:
     # ---------------------------
-    # EXIF (aplanado)
+    # Parseo único: EXIF aplanado + GPS + fecha de captura
     # ---------------------------
     @staticmethod
-    def extract_exif(img: Image.Image) -> Dict:
+    def parse_once(src: BinaryIO) -> ParsedExif:
         """
-        Devuelve un dict 'aplanado' con etiquetas EXIF legibles.
+        Parsea el EXIF del original UNA vez (piexif) y deriva de ese dict
+        el EXIF aplanado, (lon, lat) y captured_at.
+        Fallbacks: exifread solo si piexif no devolvió nada; luego XMP e ISO6709 para GPS.
+        `src` es un archivo binario con seek (p.ej. el spool del SFTP); solo se lee
+        completo si hay que caer a XMP/ISO6709.
         """
-        meta: Dict[str, str] = {}
+        parsed = ParsedExif()
 
-        # 1) Vía bytes EXIF (piexif)
+        img = None
+        exif_dict = None
         try:
+            src.seek(0)
+            img = Image.open(src)  # lazy: solo lee cabeceras
             exif_bytes = img.info.get("exif")
             if exif_bytes:
                 exif_dict = piexif.load(exif_bytes)
-                for ifd in ("0th", "Exif", "GPS", "1st"):
-                    for tag, val in (exif_dict.get(ifd, {}) or {}).items():
-                        try:
-                            name = piexif.TAGS[ifd][tag]["name"] if tag in piexif.TAGS[ifd] else str(tag)
-                        except Exception:
-                            name = str(tag)
-                        meta[f"{ifd}.{name}"] = str(val)
         except Exception:
-            logger.debug("extract_exif: piexif.load falló", exc_info=True)
+            logger.debug("parse_once: piexif.load falló", exc_info=True)
+
+        if exif_dict:
+            parsed.exif = ImageService._flatten_exif_dict(exif_dict)
+            parsed.gps = ImageService._gps_from_exif_dict(exif_dict)
+            parsed.captured_at = ImageService._captured_at_from_exif_dict(exif_dict)
+        else:
+            if img is not None:
+                parsed.exif = ImageService._flatten_pillow_exif(img)
+            tags = ImageService._exifread_tags(src)
+            parsed.gps = ImageService._gps_from_exifread_tags(tags)
+            parsed.captured_at = ImageService._captured_at_from_exifread_tags(tags)
+
+        if parsed.gps is None:
+            src.seek(0)
+            parsed.gps = ImageService._gps_from_embedded_metadata(src.read())
+
+        logger.debug(
+            "parse_once | keys=%d gps=%s captured_at=%s",
+            len(parsed.exif), parsed.gps, parsed.captured_at,
+        )
+        return parsed
 
-        # 2) Fallback vía Pillow
+    # ---------------------------
+    # EXIF (aplanado)
+    # ---------------------------
+    @staticmethod
+    def _flatten_exif_dict(exif_dict: Dict) -> Dict[str, str]:
+        """
+        Devuelve un dict 'aplanado' con etiquetas EXIF legibles a partir del dict de piexif.
+        Solo se conservan los tags de EXIF_WANTED_TAGS.
+        """
+        meta: Dict[str, str] = {}
+        for ifd in ("0th", "Exif", "GPS"):
+            tag_names = piexif.TAGS[ifd]
+            for tag, val in (exif_dict.get(ifd, {}) or {}).items():
+                info = tag_names.get(tag)
+                if info is None or info["name"] not in EXIF_WANTED_TAGS:
+                    continue
+                meta[f"{ifd}.{info['name']}"] = str(val)
+        return meta
+
+    @staticmethod
+    def _flatten_pillow_exif(img: Image.Image) -> Dict[str, str]:
+        """Fallback vía Pillow cuando piexif no pudo leer el bloque EXIF."""
+        meta: Dict[str, str] = {}
         try:
             raw = img.getexif()
             for k, v in raw.items():
-                name = ExifTags.TAGS.get(k, str(k))
-                meta[name] = str(v)
+                name = ExifTags.TAGS.get(k)
+                if name in EXIF_WANTED_TAGS:
+                    meta[name] = str(v)
         except Exception:
-            logger.debug("extract_exif: Pillow getexif falló", exc_info=True)
-
+            logger.debug("_flatten_pillow_exif: Pillow getexif falló", exc_info=True)
         return meta
 
     # ---------------------------
@@ -119,15 +184,16 @@ class ImageService:
     @staticmethod
     def _extract_xmp_packet(data: bytes) -> Optional[str]:
         try:
-            m1 = re.search(br"<x:xmpmeta[^>]*>", data, re.IGNORECASE | re.DOTALL)
-            if not m1:
-                return None
-            start = m1.start()
-            m2 = re.search(br"</x:xmpmeta>", data[start:], re.IGNORECASE)
-            if not m2:
+            # find literal (memmem en C); el XMP va en APP1, así que primero solo la cabecera
+            start = data.find(b"<x:xmpmeta", 0, XMP_HEAD_BYTES)
+            if start == -1:
+                start = data.find(b"<x:xmpmeta")
+                if start == -1:
+                    return None
+            end = data.find(b"</x:xmpmeta>", start)
+            if end == -1:
                 return None
-            end = start + m2.end()
-            return data[start:end].decode("utf-8", errors="ignore")
+            return data[start:end + len(b"</x:xmpmeta>")].decode("utf-8", errors="ignore")
         except Exception:
             return None
 
@@ -194,35 +260,40 @@ class ImageService:
     # GPS (rutas de extracción)
     # ---------------------------
     @staticmethod
-    def _gps_from_exifread_bytes(original_bytes: bytes) -> Optional[Tuple[float, float]]:
+    def _exifread_tags(src: BinaryIO) -> Dict:
+        # stop_tag compara el nombre "pelado" del tag y corta el IFD en curso:
+        # GPSLongitude es el último tag GPS que usamos (LongitudeRef va antes).
+        # details=False ya evita MakerNote y thumbnails.
+        try:
+            return exifread.process_file(src, details=False, stop_tag="GPSLongitude")
+        except Exception:
+            logger.debug("_exifread_tags falló", exc_info=True)
+            return {}
+
+    @staticmethod
+    def _gps_from_exifread_tags(tags: Dict) -> Optional[Tuple[float, float]]:
         """
-        Tu ruta preferida: exifread -> 'GPS GPSLatitude'/'GPS GPSLongitude' + convertir_coord().
+        exifread -> 'GPS GPSLatitude'/'GPS GPSLongitude' + convertir_coord().
         """
-        try:
-            tags = exifread.process_file(io.BytesIO(original_bytes), details=False)
-            lat = tags.get("GPS GPSLatitude")
-            lon = tags.get("GPS GPSLongitude")
-            lat_ref = tags.get("GPS GPSLatitudeRef")
-            lon_ref = tags.get("GPS GPSLongitudeRef")
+        lat = tags.get("GPS GPSLatitude")
+        lon = tags.get("GPS GPSLongitude")
+        lat_ref = tags.get("GPS GPSLatitudeRef")
+        lon_ref = tags.get("GPS GPSLongitudeRef")
 
-            logger.debug("exifread tags -> lat=%s lat_ref=%s lon=%s lon_ref=%s", lat, lat_ref, lon, lon_ref)
+        logger.debug("exifread tags -> lat=%s lat_ref=%s lon=%s lon_ref=%s", lat, lat_ref, lon, lon_ref)
 
-            if not (lat and lon and lat_ref and lon_ref):
-                return None
+        if not (lat and lon and lat_ref and lon_ref):
+            return None
 
-            lat_dd = ImageService._coord_str_to_decimal(str(lat), str(lat_ref))
-            lon_dd = ImageService._coord_str_to_decimal(str(lon), str(lon_ref))
-            if lat_dd is None or lon_dd is None:
-                return None
-            return (lon_dd, lat_dd)
-        except Exception:
-            logger.debug("_gps_from_exifread_bytes falló", exc_info=True)
+        lat_dd = ImageService._coord_str_to_decimal(str(lat), str(lat_ref))
+        lon_dd = ImageService._coord_str_to_decimal(str(lon), str(lon_ref))
+        if lat_dd is None or lon_dd is None:
             return None
+        return (lon_dd, lat_dd)
 
     @staticmethod
-    def _gps_from_piexif_bytes(exif_bytes: bytes) -> Optional[Tuple[float, float]]:
+    def _gps_from_exif_dict(exif_dict: Dict) -> Optional[Tuple[float, float]]:
         try:
-            exif_dict = piexif.load(exif_bytes)
             gps_ifd = exif_dict.get("GPS", {}) or {}
             lat = gps_ifd.get(piexif.GPSIFD.GPSLatitude)
             lat_ref = gps_ifd.get(piexif.GPSIFD.GPSLatitudeRef)
@@ -237,38 +308,17 @@ class ImageService:
             lon_dd = ImageService._dms_to_dd(d, m, s, lon_ref)
             return (lon_dd, lat_dd)
         except Exception:
-            logger.debug("_gps_from_piexif_bytes falló", exc_info=True)
+            logger.debug("_gps_from_exif_dict falló", exc_info=True)
             return None
 
     @staticmethod
-    def extract_gps_from_original(original_bytes: bytes, compressed_img: Optional[Image.Image] = None) -> Optional[Tuple[float, float]]:
+    def _gps_from_embedded_metadata(original_bytes: bytes) -> Optional[Tuple[float, float]]:
         """
-        Intenta extraer (lon, lat) en este orden:
-        1) exifread (como en tu script)
-        2) piexif sobre EXIF de los bytes originales
-        3) XMP embebido
-        4) QuickTime ISO6709 (HEIC/Apple)
-        5) EXIF de la imagen comprimida (último recurso)
+        Fallback cuando no hay GPS en EXIF:
+        1) XMP embebido
+        2) QuickTime ISO6709 (HEIC/Apple)
         """
-        # 1) exifread
-        gps = ImageService._gps_from_exifread_bytes(original_bytes)
-        if gps:
-            logger.debug("GPS desde exifread: %s", gps)
-            return gps
-
-        # 2) piexif: leer EXIF de los bytes originales si Pillow lo expone
-        try:
-            im0 = Image.open(io.BytesIO(original_bytes))
-            exif0 = im0.info.get("exif")
-        except Exception:
-            exif0 = None
-        if exif0:
-            gps = ImageService._gps_from_piexif_bytes(exif0)
-            if gps:
-                logger.debug("GPS desde piexif (original): %s", gps)
-                return gps
-
-        # 3) XMP
+        # 1) XMP
         xmp_xml = ImageService._extract_xmp_packet(original_bytes)
         if xmp_xml:
             gps = ImageService._parse_xmp_gps(xmp_xml)
@@ -276,24 +326,12 @@ class ImageService:
                 logger.debug("GPS desde XMP: %s", gps)
                 return gps
 
-        # 4) QuickTime ISO6709 (HEIC/Apple)
+        # 2) QuickTime ISO6709 (HEIC/Apple)
         gps = ImageService._find_iso6709(original_bytes)
         if gps:
             logger.debug("GPS desde ISO6709: %s", gps)
             return gps
 
-        # 5) EXIF de la comprimida
-        if compressed_img is not None:
-            try:
-                exif1 = compressed_img.info.get("exif")
-                if exif1:
-                    gps = ImageService._gps_from_piexif_bytes(exif1)
-                    if gps:
-                        logger.debug("GPS desde piexif (comprimida): %s", gps)
-                        return gps
-            except Exception:
-                logger.debug("No pude leer EXIF de la comprimida", exc_info=True)
-
         logger.debug("No se pudo extraer GPS por ningún método")
         return None
 
@@ -301,71 +339,100 @@ class ImageService:
     # Fecha de captura
     # ---------------------------
     @staticmethod
-    def extract_captured_at(img: Image.Image, original_bytes: Optional[bytes] = None) -> Optional[datetime]:
+    def _parse_exif_datetime(raw) -> Optional[datetime]:
+        if isinstance(raw, bytes):
+            raw = raw.decode(errors="ignore")
+        dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
+        return dt.replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def _captured_at_from_exif_dict(exif_dict: Dict) -> Optional[datetime]:
         """
-        Devuelve DateTimeOriginal (UTC) si está en EXIF. Fallback con exifread si es posible.
+        Devuelve DateTimeOriginal (UTC) desde el dict de piexif.
         """
-        # 1) piexif desde PIL
         try:
-            exif_bytes = img.info.get("exif")
-            if exif_bytes:
-                exif_dict = piexif.load(exif_bytes)
-                exif_ifd = exif_dict.get("Exif", {}) or {}
-                raw = exif_ifd.get(piexif.ExifIFD.DateTimeOriginal) or exif_ifd.get(piexif.ExifIFD.DateTimeDigitized)
-                if not raw:
-                    raw = (exif_dict.get("0th", {}) or {}).get(piexif.ImageIFD.DateTime)
-                if raw:
-                    if isinstance(raw, bytes):
-                        raw = raw.decode(errors="ignore")
-                    dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
-                    return dt.replace(tzinfo=timezone.utc)
+            exif_ifd = exif_dict.get("Exif", {}) or {}
+            raw = exif_ifd.get(piexif.ExifIFD.DateTimeOriginal) or exif_ifd.get(piexif.ExifIFD.DateTimeDigitized)
+            if not raw:
+                raw = (exif_dict.get("0th", {}) or {}).get(piexif.ImageIFD.DateTime)
+            if raw:
+                return ImageService._parse_exif_datetime(raw)
         except Exception:
-            logger.debug("extract_captured_at: piexif falló", exc_info=True)
-
-        # 2) Fallback exifread sobre bytes originales
-        if original_bytes:
-            try:
-                tags = exifread.process_file(io.BytesIO(original_bytes), details=False)
-                raw = tags.get("EXIF DateTimeOriginal") or tags.get("Image DateTime")
-                if raw:
-                    dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
-                    return dt.replace(tzinfo=timezone.utc)
-            except Exception:
-                logger.debug("extract_captured_at: exifread falló", exc_info=True)
+            logger.debug("_captured_at_from_exif_dict falló", exc_info=True)
+        return None
 
+    @staticmethod
+    def _captured_at_from_exifread_tags(tags: Dict) -> Optional[datetime]:
+        try:
+            raw = tags.get("EXIF DateTimeOriginal") or tags.get("Image DateTime")
+            if raw:
+                return ImageService._parse_exif_datetime(raw)
+        except Exception:
+            logger.debug("_captured_at_from_exifread_tags falló", exc_info=True)
         return None
 
     # ---------------------------
     # Compresión JPEG a ~1 MB
     # ---------------------------
     @staticmethod
-    def compress_to_target_jpeg(data: bytes, target_bytes: int) -> Tuple[bytes, int, int, str]:
+    def compress_to_target_jpeg(src: BinaryIO, target_bytes: int) -> Tuple[bytes, int, int, str]:
         """
         Convierte a JPEG preservando EXIF (si existía) y ajusta calidad hasta <= target_bytes.
         """
-        img = Image.open(io.BytesIO(data))
-        img = img.convert("RGB")  # fuerza JPEG
-
-        # EXIF del original para preservarlo
-        exif_preserve = None
-        try:
-            exif_preserve = Image.open(io.BytesIO(data)).info.get("exif", None)
-            if exif_preserve:
-                logger.debug("Preservando EXIF original (bytes=%d)", len(exif_preserve))
-        except Exception:
-            logger.debug("No pude obtener EXIF del original para preservarlo", exc_info=True)
-
-        quality = 92
-        step = 6
-        out = io.BytesIO()
-        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True, exif=exif_preserve)
-        b = out.getvalue()
-
-        while len(b) > target_bytes and quality > 10:
-            quality = max(10, quality - step)
+        src.seek(0)
+        img = Image.open(src)
+
+        # EXIF del original para preservarlo (misma instancia, sin re-abrir)
+        exif_preserve = img.info.get("exif", b"")
+        if exif_preserve:
+            logger.debug("Preservando EXIF original (bytes=%d)", len(exif_preserve))
+
+        # libjpeg escala en la IDCT al decodificar: no se decodifica a resolución completa
+        # si la imagen sobra por mucho (el resultado queda >= IMAGE_DRAFT_MIN_PX por lado)
+        if img.format == "JPEG":
+            img.draft("RGB", (settings.IMAGE_DRAFT_MIN_PX, settings.IMAGE_DRAFT_MIN_PX))
+        if img.mode != "RGB":
+            img = img.convert("RGB")  # fuerza JPEG
+
+        # Mismos kwargs (y mismo objeto EXIF) en cada intento; solo varía quality.
+        # optimize/progressive (pasada extra de Huffman) solo en encodes que se entregan:
+        # los sondeos de la bisección van sin ellas
+        save_kwargs = dict(format="JPEG", optimize=True, progressive=True, exif=exif_preserve)
+        probe_kwargs = dict(format="JPEG", exif=exif_preserve)
+
+        def encode(q: int, final: bool = True) -> io.BytesIO:
             out = io.BytesIO()
-            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True, exif=exif_preserve)
-            b = out.getvalue()
+            img.save(out, quality=q, **(save_kwargs if final else probe_kwargs))
+            return out  # el tamaño sale de out.tell(), sin copiar a bytes
+
+        # q=85 es visualmente casi igual a 92 y para ~1 MB suele entrar en una sola pasada
+        # (por eso este primer intento ya va optimizado)
+        quality = 85
+        out = encode(quality)
+
+        if out.tell() > target_bytes:
+            # Bisección acotada sobre [10, 84]: mayor calidad que entre en target_bytes
+            lo, hi = 10, quality - 1
+            best = None
+            for _ in range(4):
+                if lo > hi:
+                    break
+                mid = (lo + hi) // 2
+                cand = encode(mid, final=False)
+                if cand.tell() <= target_bytes:
+                    best, lo = (mid, cand), mid + 1
+                else:
+                    hi = mid - 1
+            if best:
+                quality, probe = best
+                out = encode(quality)
+                if out.tell() > probe.tell():
+                    out = probe  # raro: la versión optimizada salió más grande que el sondeo
+            else:
+                quality, out = 10, encode(10)
+            logger.debug("compress_to_target_jpeg: quality=%d bytes=%d", quality, out.tell())
+
+        b = out.getvalue()  # única materialización a bytes
 
         w, h = img.size
         return b, w, h, "image/jpeg"
@@ -0,0 +1,52 @@
+import io
+from datetime import timedelta
+from functools import lru_cache
+from minio import Minio
+from app.core.settings import get_settings
+
+settings = get_settings()
+
+class ObjectStorage:
+    """Binarios de fotos en S3/MinIO; en la DB queda solo la clave del objeto."""
+
+    def __init__(self):
+        self.bucket = settings.S3_BUCKET
+        # region explícita: presigned_get_object firma local, sin pedir la ubicación del bucket
+        self.client = Minio(
+            settings.S3_ENDPOINT,
+            access_key=settings.S3_ACCESS_KEY,
+            secret_key=settings.S3_SECRET_KEY,
+            secure=settings.S3_SECURE,
+            region=settings.S3_REGION,
+        )
+
+    def ensure_bucket(self) -> None:
+        if not self.client.bucket_exists(self.bucket):
+            self.client.make_bucket(self.bucket)
+
+    def put_bytes(self, key: str, data: bytes, content_type: str) -> None:
+        self.client.put_object(self.bucket, key, io.BytesIO(data), len(data), content_type=content_type)
+
+    def delete(self, key: str) -> None:
+        self.client.remove_object(self.bucket, key)
+
+    def presigned_url(self, key: str, filename: str) -> str:
+        return self.client.presigned_get_object(
+            self.bucket,
+            key,
+            expires=timedelta(seconds=settings.S3_PRESIGN_EXPIRES_S),
+            response_headers={
+                "response-content-disposition": f'attachment; filename="{filename}"',
+            },
+        )
+
+    def healthy(self) -> bool:
+        try:
+            return self.client.bucket_exists(self.bucket)
+        except Exception:
+            return False
+
+
+@lru_cache
+def get_object_storage() -> ObjectStorage:
+    return ObjectStorage()
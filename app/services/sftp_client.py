@@ -1,8 +1,52 @@
-import io
+import itertools
+import shutil
+import threading
+from tempfile import SpooledTemporaryFile
+from functools import lru_cache
+from typing import Callable, Optional, TypeVar
 import paramiko
 from app.core.settings import get_settings
 
 settings = get_settings()
+T = TypeVar("T")
+
+# Hasta 8 MB el original queda en memoria; más grande, se vuelca a disco
+SPOOL_MAX_BYTES = 8 << 20
+
+
+class _SFTPSession:
+    """Una conexión SSH + canal SFTP, con su propio lock (un canal no es thread-safe)."""
+
+    def __init__(self):
+        self.transport: Optional[paramiko.Transport] = None
+        self.sftp: Optional[paramiko.SFTPClient] = None
+        self.lock = threading.Lock()
+
+    def connect(self, host: str, port: int, user: str, password: str) -> paramiko.SFTPClient:
+        # Requiere lock tomado
+        if self.transport is None or not self.transport.is_active():
+            self.close()
+            transport = paramiko.Transport((host, port))
+            try:
+                transport.connect(username=user, password=password)
+                sftp = paramiko.SFTPClient.from_transport(transport)
+            except Exception:
+                transport.close()
+                raise
+            self.transport = transport
+            self.sftp = sftp
+        return self.sftp
+
+    def close(self) -> None:
+        for conn in (self.sftp, self.transport):
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        self.sftp = None
+        self.transport = None
+
 
 class SFTPClient:
     def __init__(self):
@@ -11,24 +55,53 @@ class SFTPClient:
         self.user = settings.SFTP_USER
         self.password = settings.SFTP_PASSWORD
 
-    def fetch_bytes(self, path: str) -> bytes:
-        transport = paramiko.Transport((self.host, self.port))
-        transport.connect(username=self.user, password=self.password)
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        try:
-            with sftp.open(path, 'rb') as f:
-                return f.read()
-        finally:
-            sftp.close()
-            transport.close()
+        # Pool de sesiones persistentes (conexión lazy), elegidas round-robin
+        self._sessions = [_SFTPSession() for _ in range(max(1, settings.SFTP_POOL_SIZE))]
+        self._rr = itertools.cycle(self._sessions)
+        self._rr_lock = threading.Lock()
+
+    def _run(self, op: Callable[[paramiko.SFTPClient], T]) -> T:
+        with self._rr_lock:
+            session = next(self._rr)
+        with session.lock:
+            try:
+                return op(session.connect(self.host, self.port, self.user, self.password))
+            except (paramiko.SSHException, EOFError):
+                # Sesión caída: reconectar una vez y reintentar
+                session.close()
+                return op(session.connect(self.host, self.port, self.user, self.password))
+
+    def fetch_to_spool(self, path: str) -> SpooledTemporaryFile:
+        """
+        Copia el archivo remoto a un SpooledTemporaryFile posicionado al inicio,
+        para que PIL/exifread lo lean sin una copia completa extra en bytes.
+        """
+        def copy(sftp: paramiko.SFTPClient) -> SpooledTemporaryFile:
+            spool = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+            try:
+                with sftp.open(path, 'rb') as f:
+                    f.prefetch()  # read-ahead por ventanas: varias requests en vuelo
+                    shutil.copyfileobj(f, spool)
+            except BaseException:
+                spool.close()
+                raise
+            spool.seek(0)
+            return spool
+        return self._run(copy)
 
     def healthy(self) -> bool:
         try:
-            transport = paramiko.Transport((self.host, self.port))
-            transport.connect(username=self.user, password=self.password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
-            sftp.listdir(settings.SFTP_BASE_PATH)
-            sftp.close(); transport.close()
+            self._run(lambda sftp: sftp.listdir(settings.SFTP_BASE_PATH))
             return True
         except Exception:
-            return False
\ No newline at end of file
+            return False
+
+    def close(self) -> None:
+        for session in self._sessions:
+            with session.lock:
+                session.close()
+
+
+@lru_cache
+def get_sftp_client() -> SFTPClient:
+    return SFTPClient()
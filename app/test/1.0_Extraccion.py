@@ -4,7 +4,32 @@ from PIL import Image
 import io
 import csv
 import os
-import json
+import sys
+import struct
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+CARPETA_ENTRADA = "Entrada"
+CARPETA_SALIDA_FOTO = "Salida/Foto"
+CARPETA_SALIDA_DATO = "Salida/Dato"
+CARPETA_SALIDA_ICON = "Salida/Icon"
+CARPETA_SALIDA_FULL = "Salida/full"
+
+# Volcar a stdout los datos resumidos de cada imagen (depuración)
+VERBOSE = False
+
+# Lado mínimo al decodificar con draft: libjpeg reduce 1/2, 1/4, 1/8 en la IDCT
+DRAFT_MIN_PX = 2048
+
+# El APP1 (EXIF) está al principio del JPEG: exifread sólo necesita la cabecera
+EXIFREAD_HEAD_BYTES = 128 * 1024
+
+# Comillas y corchetes que exifread deja alrededor de la terna de coordenadas
+_CLEAN_TBL = str.maketrans('', '', '\'"[]')
+
+# orjson escribe UTF-8 directo (equivale a ensure_ascii=False)
+ORJSON_OPCIONES = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
 
 # Mapeo para renombrar etiquetas EXIF
 mapeo = {
@@ -83,90 +108,179 @@ mapeo = {
     "size MakerNote (bytes)": "Tamano MakerNote (bytes)"
 }
 
+# Constantes por lote, no por imagen
+# Pares (etiqueta exifread, nombre de salida): se renombra al extraer, sin dict intermedio
+ETIQUETAS_DESEADAS = tuple(mapeo.items())
+
+# Claves que van al JSON resumido (_DATO)
+CLAVES_DATO = (
+    "Fecha",
+    "Lat",
+    "Lon",
+    "Altitud (m)",
+    "Tamano (MP)",
+    "Marca del lente",
+    "Modelo del lente",
+    "Version EXIF",
+    "Velocidad de obturacion (EV)",
+    "Numero F",
+    "Focal equivalente 35mm",
+    "ISO",
+)
+
+# Los valores EXIF se repiten mucho entre fotos de la misma cámara: se cachean
+@lru_cache(maxsize=4096)
 def fraccion_a_float(frac_str):
     """Convierte una fracción tipo 'numerador/denominador' a float."""
     try:
-        num, den = frac_str.split('/')
-        return float(num) / float(den)
+        if '/' in frac_str:
+            num, den = frac_str.split('/')
+            return float(num) / float(den)
+        return float(frac_str)
     except Exception:
-        try:
-            return float(frac_str)
-        except:
-            return None
+        return None
 
+@lru_cache(maxsize=4096)
 def convertir_coord(coord_str, ref):
+    # Limpio la cadena en una sola pasada; float() ya ignora los espacios
+    partes = coord_str.translate(_CLEAN_TBL).split(',')
+    if len(partes) != 3:
+        return None
     try:
-        # Limpio la cadena: quito comillas y espacios
-        coord_str = coord_str.strip().replace('"', '').replace("'", "").replace("[", "").replace("]", "")
-        partes = coord_str.split(',')
-        if len(partes) != 3:
-            return None
-        grados = float(partes[0].strip())
-        minutos = float(partes[1].strip())
-        segundos = fraccion_a_float(partes[2].strip())
-        if segundos is None:
-            segundos = 0.0
-        decimal = grados + minutos / 60 + segundos / 3600
-        if ref in ['S', 'W']:
-            decimal = -decimal
-        return decimal
-    except Exception as e:
+        grados = float(partes[0])
+        minutos = float(partes[1])
+    except ValueError as e:
         print(f"Error al convertir coordenada: '{coord_str}' -> {e}")
         return None
+    segundos = fraccion_a_float(partes[2].strip())
+    if segundos is None:
+        segundos = 0.0
+    decimal = grados + minutos / 60 + segundos / 3600
+    if ref in ['S', 'W']:
+        decimal = -decimal
+    return decimal
 
 
+def coord_desde_racionales(racionales, ref):
+    """Convierte ((g,1),(m,1),(s,den)) de piexif a grados decimales, sin pasar por strings."""
+    try:
+        grados, minutos, segundos = (num / den for num, den in racionales)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if isinstance(ref, bytes):
+        ref = ref.decode('ascii', 'ignore')
+    decimal = grados + minutos / 60 + segundos / 3600
+    if ref in ['S', 'W']:
+        decimal = -decimal
+    return decimal
+
 def convertir_altitud(altitud_str):
     """Convierte altitud en formato fracción a float."""
     return fraccion_a_float(altitud_str)
 
-def obtener_tamanos_exif_y_thumbnail(ruta_imagen):
-    with open(ruta_imagen, 'rb') as f:
-        data = f.read()
-
-    pos_exif = data.find(b'\xff\xe1')  # Marca inicio EXIF (APP1)
+def segmentos_jpeg(data):
+    """
+    Recorre las cabeceras de un JPEG desde el SOI y produce (marcador, inicio, fin) por
+    segmento (fin exclusivo). El último es el SOS, con fin = len(data). Si la estructura
+    no es válida el recorrido se corta sin llegar al SOS.
+    """
+    if data[:2] != b'\xff\xd8':
+        return
+    p = 2
+    while p + 4 <= len(data):
+        if data[p] != 0xFF:
+            return
+        marcador = data[p+1]
+        if marcador == 0xFF:  # bytes de relleno entre segmentos
+            p += 1
+            continue
+        if marcador == 0xDA:  # SOS: empiezan los datos de imagen, no hay más cabeceras
+            yield marcador, p, len(data)
+            return
+        fin = p + 2 + struct.unpack('>H', data[p+2:p+4])[0]
+        yield marcador, p, fin
+        p = fin
+
+def buscar_segmento_app1(data):
+    """Devuelve la posición del APP1 EXIF (o -1)."""
+    for marcador, inicio, _ in segmentos_jpeg(data):
+        if marcador == 0xE1 and data[inicio+4:inicio+10] == b'Exif\x00\x00':
+            return inicio
+    return -1
+
+def quitar_metadatos_jpeg(data):
+    """
+    Devuelve el JPEG sin segmentos APP1 (EXIF/XMP), APP13 (IPTC) ni el índice MPF (APP2),
+    copiando el resto tal cual: no se decodifican ni recodifican píxeles. Se corta en el EOI
+    de la imagen principal. None si no es un JPEG recorrible.
+    """
+    partes = [b'\xff\xd8']
+    for marcador, inicio, fin in segmentos_jpeg(data):
+        if marcador == 0xDA:
+            # Datos de imagen hasta el primer EOI (el byte stuffing impide un FF D9 antes).
+            # Lo que sigue son imágenes auxiliares (p.ej. el gain map HDR de iPhone, con su XMP)
+            eoi = data.find(b'\xff\xd9', inicio)
+            partes.append(data[inicio:eoi + 2] if eoi != -1 else data[inicio:])
+            return b''.join(partes)
+        if marcador in (0xE1, 0xED):
+            continue
+        if marcador == 0xE2 and data[inicio+4:inicio+8] == b'MPF\x00':
+            continue  # índice Multi-Picture: apunta a las imágenes auxiliares descartadas
+        partes.append(data[inicio:fin])
+    return None
+
+def obtener_tamanos_exif_y_thumbnail(data, exif_dict):
+    pos_exif = buscar_segmento_app1(data)  # Marca inicio EXIF (APP1)
     if pos_exif == -1:
         return 0, 0, 0, None
 
-    tamano_exif = int.from_bytes(data[pos_exif+2:pos_exif+4], 'big')
-    bloque_exif = data[pos_exif+4:pos_exif+2+tamano_exif]
+    tamano_exif = struct.unpack('>H', data[pos_exif+2:pos_exif+4])[0]
 
-    pos_thumb_start = bloque_exif.find(b'\xff\xd8')
-    pos_thumb_end = bloque_exif.find(b'\xff\xd9', pos_thumb_start)
-    if pos_thumb_start != -1 and pos_thumb_end != -1:
-        tamano_thumbnail = pos_thumb_end - pos_thumb_start + 2
-        thumbnail_bytes = bloque_exif[pos_thumb_start:pos_thumb_end+2]
-    else:
-        tamano_thumbnail = 0
-        thumbnail_bytes = None
+    # piexif ya ubicó el thumbnail por el IFD1 (JPEGInterchangeFormat/Length)
+    thumbnail_bytes = exif_dict.get('thumbnail') or None
+    tamano_thumbnail = len(thumbnail_bytes) if thumbnail_bytes else 0
 
     tamano_sin_thumbnail = tamano_exif - tamano_thumbnail
     return tamano_exif, tamano_thumbnail, tamano_sin_thumbnail, thumbnail_bytes
 
-def extraer_datos_makernote(path):
-    exif_dict = piexif.load(path)
+def extraer_datos_makernote(exif_dict):
     maker_note = exif_dict['Exif'].get(piexif.ExifIFD.MakerNote)
     return len(maker_note) if maker_note else 0
 
-def extraer_etiquetas_exif(ruta_imagen, etiquetas_deseadas):
-    with open(ruta_imagen, 'rb') as f:
-        tags = exifread.process_file(f, details=False)
+def extraer_etiquetas_exif(data, etiquetas_deseadas):
+    tags = exifread.process_file(io.BytesIO(data[:EXIFREAD_HEAD_BYTES]), details=False)
+    if 'EXIF ExifVersion' not in tags and len(data) > EXIFREAD_HEAD_BYTES:
+        # EXIF cortado (APP1 enorme o precedido de otros segmentos): archivo completo
+        tags = exifread.process_file(io.BytesIO(data), details=False)
     resultados = {}
-    for etiqueta in etiquetas_deseadas:
+    for etiqueta, nombre in etiquetas_deseadas:
         valor = tags.get(etiqueta)
-        resultados[etiqueta] = str(valor) if valor else ""
+        resultados[nombre] = str(valor) if valor else ""
     return resultados
 
+def es_decimal(texto):
+    """True si el texto es un número simple ('7.1', '-3', ' 100 '): float() no va a fallar."""
+    t = texto.strip()
+    if t[:1] in ('+', '-'):
+        t = t[1:]
+    return t.replace('.', '', 1).isdecimal()
+
+@lru_cache(maxsize=4096)
 def fraccion_a_decimal(valor):
-    if isinstance(valor, str) and '/' in valor:
-        try:
-            num, den = valor.split('/')
-            return float(num) / float(den)
-        except Exception:
-            return valor  # si no puede convertir, devolver original
-    try:
+    # Validación previa en vez de excepciones: "" y los textos no numéricos son el caso común
+    if isinstance(valor, (int, float)):
         return float(valor)
-    except:
-        return valor
+    if not isinstance(valor, str):
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return valor
+    num, barra, den = valor.partition('/')
+    if not barra:
+        return float(valor) if es_decimal(valor) else valor
+    if es_decimal(num) and es_decimal(den) and float(den) != 0:
+        return float(num) / float(den)
+    return valor  # si no puede convertir, devolver original
 
 def guardar_csv(datos_dict, ruta_csv):
     with open(ruta_csv, 'w', newline='', encoding='utf-8') as csvfile:
@@ -175,23 +289,54 @@ def guardar_csv(datos_dict, ruta_csv):
         for k, v in datos_dict.items():
             writer.writerow([k, v])
 
-def guardar_jpeg_sin_metadatos(ruta_imagen, ruta_salida_jpeg, tamano_max_bytes=2_097_152):
-    with Image.open(ruta_imagen) as img:
-        calidad = 100
-        paso = 5
-
-        # Comprimir iterativamente hasta que el tamaño cumpla el límite
-        while calidad > 5:
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=calidad)
-            if buffer.tell() <= tamano_max_bytes:
-                with open(ruta_salida_jpeg, 'wb') as f_out:
-                    f_out.write(buffer.getvalue())
-                return
-            calidad -= paso
-
-        # Si no se pudo cumplir el tamaño, guardar con la calidad mínima alcanzada
-        img.save(ruta_salida_jpeg, format='JPEG', quality=calidad)
+def guardar_jpeg_sin_metadatos(data, ruta_salida_jpeg, tamano_max_bytes=2_097_152):
+    # Si el original ya entra en el límite basta con quitarle los metadatos, sin recodificar
+    if len(data) <= tamano_max_bytes:
+        sin_metadatos = quitar_metadatos_jpeg(data)
+        if sin_metadatos is not None:
+            with open(ruta_salida_jpeg, 'wb') as f_out:
+                f_out.write(sin_metadatos)
+            return
+
+    with Image.open(io.BytesIO(data)) as img:
+        # Sólo fotos muy grandes (>= 2x DRAFT_MIN_PX por lado) se decodifican reducidas
+        img.draft('RGB', (DRAFT_MIN_PX, DRAFT_MIN_PX))
+        buffer = io.BytesIO()
+
+        def codificar(destino, calidad):
+            destino.seek(0)
+            destino.truncate()
+            img.save(destino, format='JPEG', quality=calidad)
+            return destino.tell()
+
+        def escribir(origen):
+            # getbuffer(): se escribe la memoria del BytesIO sin copiarla
+            with open(ruta_salida_jpeg, 'wb') as f_out, origen.getbuffer() as vista:
+                f_out.write(vista)
+
+        # Caso común: entra a calidad máxima con un solo encode
+        if codificar(buffer, 100) <= tamano_max_bytes:
+            escribir(buffer)
+            return
+
+        # Bisección sobre la calidad: mayor calidad que cumple el límite.
+        # El encode que entra se conserva intercambiando buffers, sin copiar bytes.
+        mejor = None
+        lo, hi = 10, 99
+        while lo <= hi:
+            medio = (lo + hi) // 2
+            if codificar(buffer, medio) <= tamano_max_bytes:
+                mejor, buffer = buffer, (mejor if mejor is not None else io.BytesIO())
+                lo = medio + 1
+            else:
+                hi = medio - 1
+
+        if mejor is not None:
+            escribir(mejor)
+            return
+
+        # Si no se pudo cumplir el tamaño, guardar con la calidad mínima
+        img.save(ruta_salida_jpeg, format='JPEG', quality=5)
 
 
 def guardar_thumbnail_jpeg(thumbnail_bytes, ruta_salida_thumbnail):
@@ -200,33 +345,34 @@ def guardar_thumbnail_jpeg(thumbnail_bytes, ruta_salida_thumbnail):
         thumbnail_image.save(ruta_salida_thumbnail, format='JPEG', quality=95)
 
 def procesar_imagen(ruta_imagen):
+    # Las carpetas de salida las crea main() una sola vez
     nombre_base = os.path.splitext(os.path.basename(ruta_imagen))[0]
-    carpeta_salida_foto = "Salida/Foto"
-    carpeta_salida_dato = "Salida/Dato"
-    carpeta_salida_icon = "Salida/Icon"
-    carpeta_salida_full = "Salida/full"
-    os.makedirs(carpeta_salida_foto, exist_ok=True)
-    os.makedirs(carpeta_salida_dato, exist_ok=True)
-    os.makedirs(carpeta_salida_icon, exist_ok=True)
-    os.makedirs(carpeta_salida_full, exist_ok=True)
 
-    etiquetas = list(mapeo.keys())
-    datos_exif = extraer_etiquetas_exif(ruta_imagen, etiquetas)
+    # Una sola lectura del archivo; todos los parsers trabajan sobre estos bytes
+    with open(ruta_imagen, 'rb') as f:
+        data = f.read()
 
-    tamano_exif, tamano_thumbnail, tamano_sin_thumbnail, thumbnail_bytes = obtener_tamanos_exif_y_thumbnail(ruta_imagen)
-    tamano_makernote = extraer_datos_makernote(ruta_imagen)
+    # Claves ya renombradas según mapeo
+    datos_exif_renombrado = extraer_etiquetas_exif(data, ETIQUETAS_DESEADAS)
 
-    datos_exif["size total bloque EXIF (bytes)"] = tamano_exif
-    datos_exif["size thumbnail JPEG embebido (bytes)"] = tamano_thumbnail
-    datos_exif["size aproximado metadatos EXIF sin thumbnail (bytes)"] = tamano_sin_thumbnail
-    datos_exif["size MakerNote (bytes)"] = tamano_makernote
+    exif_dict = piexif.load(data)
+    tamano_exif, tamano_thumbnail, tamano_sin_thumbnail, thumbnail_bytes = obtener_tamanos_exif_y_thumbnail(data, exif_dict)
+    tamano_makernote = extraer_datos_makernote(exif_dict)
 
-    # Renombrar claves
-    datos_exif_renombrado = {mapeo.get(k, k): v for k, v in datos_exif.items()}
+    datos_exif_renombrado[mapeo["size total bloque EXIF (bytes)"]] = tamano_exif
+    datos_exif_renombrado[mapeo["size thumbnail JPEG embebido (bytes)"]] = tamano_thumbnail
+    datos_exif_renombrado[mapeo["size aproximado metadatos EXIF sin thumbnail (bytes)"]] = tamano_sin_thumbnail
+    datos_exif_renombrado[mapeo["size MakerNote (bytes)"]] = tamano_makernote
 
     # Convertir lat, lon, alt a decimal y agregar a dict
-    lat_dec = convertir_coord(datos_exif_renombrado.get("Latitud", ""), datos_exif_renombrado.get("Ref latitud", "N"))
-    lon_dec = convertir_coord(datos_exif_renombrado.get("Longitud", ""), datos_exif_renombrado.get("Ref longitud", "E"))
+    # Lat/lon desde los racionales de piexif; el string de exifread queda como respaldo
+    gps = exif_dict.get('GPS') or {}
+    lat_dec = coord_desde_racionales(gps.get(piexif.GPSIFD.GPSLatitude), gps.get(piexif.GPSIFD.GPSLatitudeRef, b'N'))
+    if lat_dec is None:
+        lat_dec = convertir_coord(datos_exif_renombrado.get("Latitud", ""), datos_exif_renombrado.get("Ref latitud", "N"))
+    lon_dec = coord_desde_racionales(gps.get(piexif.GPSIFD.GPSLongitude), gps.get(piexif.GPSIFD.GPSLongitudeRef, b'E'))
+    if lon_dec is None:
+        lon_dec = convertir_coord(datos_exif_renombrado.get("Longitud", ""), datos_exif_renombrado.get("Ref longitud", "E"))
     alt_m = convertir_altitud(datos_exif_renombrado.get("Altitud GPS", ""))
 
     datos_exif_renombrado["Lat"] = lat_dec if lat_dec is not None else ""
@@ -255,47 +401,41 @@ def procesar_imagen(ruta_imagen):
         datos_exif_renombrado["Tamano (MP)"] = "N/A"
 
     # Guardar JSON completo
-    ruta_json_full = os.path.join(carpeta_salida_full, f"{nombre_base}_FULL.json")
-    with open(ruta_json_full, 'w', encoding='utf-8') as jsonfile:
-        json.dump(datos_exif_renombrado, jsonfile, ensure_ascii=False, indent=4)
+    ruta_json_full = os.path.join(CARPETA_SALIDA_FULL, f"{nombre_base}_FULL.json")
+    with open(ruta_json_full, 'wb') as jsonfile:
+        jsonfile.write(orjson.dumps(datos_exif_renombrado, option=ORJSON_OPCIONES))
 
     # Filtrado para _DATO.json
-    claves_dato = [
-        "Fecha",
-        "Lat",
-        "Lon",
-        "Altitud (m)",
-        "Tamano (MP)",
-        "Marca del lente",
-        "Modelo del lente",
-        "Version EXIF",
-        "Velocidad de obturacion (EV)",
-        "Numero F",
-        "Focal equivalente 35mm",
-        "ISO",
-    ]
-    datos_dato = {k: datos_exif_renombrado[k] for k in claves_dato if k in datos_exif_renombrado}
+    datos_dato = {k: datos_exif_renombrado[k] for k in CLAVES_DATO if k in datos_exif_renombrado}
 
-    for clave, valor in datos_dato.items():
-        print(f"{clave}: {valor}")
+    if VERBOSE:
+        # Una sola escritura por imagen: sin contención del lock de stdout entre procesos
+        sys.stdout.write('\n'.join(f"{clave}: {valor}" for clave, valor in datos_dato.items()) + '\n')
 
     # Guardar como JSON
-    ruta_json_dato = os.path.join(carpeta_salida_dato, f"{nombre_base}_DATO.json")
-    with open(ruta_json_dato, 'w', encoding='utf-8') as jsonfile:
-        json.dump(datos_dato, jsonfile, ensure_ascii=False, indent=4)
+    ruta_json_dato = os.path.join(CARPETA_SALIDA_DATO, f"{nombre_base}_DATO.json")
+    with open(ruta_json_dato, 'wb') as jsonfile:
+        jsonfile.write(orjson.dumps(datos_dato, option=ORJSON_OPCIONES))
 
-    ruta_jpeg = os.path.join(carpeta_salida_foto, f"{nombre_base}_FOTO.jpg")
-    guardar_jpeg_sin_metadatos(ruta_imagen, ruta_jpeg)
+    ruta_jpeg = os.path.join(CARPETA_SALIDA_FOTO, f"{nombre_base}_FOTO.jpg")
+    guardar_jpeg_sin_metadatos(data, ruta_jpeg)
 
-    guardar_thumbnail_jpeg(thumbnail_bytes, os.path.join(carpeta_salida_icon, f"{nombre_base}_ICON.jpg"))
+    guardar_thumbnail_jpeg(thumbnail_bytes, os.path.join(CARPETA_SALIDA_ICON, f"{nombre_base}_ICON.jpg"))
 
 def main():
-    carpeta_entrada = "Entrada"
-    for archivo in os.listdir(carpeta_entrada):
-        if archivo.lower().endswith(('.jpg', '.jpeg')):
-            ruta = os.path.join(carpeta_entrada, archivo)
-            print(f"Procesando: {ruta}")
-            procesar_imagen(ruta)
+    for carpeta in (CARPETA_SALIDA_FOTO, CARPETA_SALIDA_DATO, CARPETA_SALIDA_ICON, CARPETA_SALIDA_FULL):
+        os.makedirs(carpeta, exist_ok=True)
+
+    rutas = [
+        os.path.join(CARPETA_ENTRADA, archivo)
+        for archivo in os.listdir(CARPETA_ENTRADA)
+        if archivo.lower().endswith(('.jpg', '.jpeg'))
+    ]
+
+    # Cada imagen es independiente: una por proceso (decode/re-encode JPEG es CPU-bound)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for ruta, _ in zip(rutas, executor.map(procesar_imagen, rutas, chunksize=4)):
+            print(f"Procesada: {ruta}")
 
 if __name__ == "__main__":
     main()
@@ -1,44 +1,56 @@
 import os
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+
+def _leer_json(entrada):
+    with open(entrada.path, 'rb') as f:
+        return entrada.name, orjson.loads(f.read())
+
+def _armar_feature(archivo, datos, carpeta_icon_abs):
+    """Feature GeoJSON de un _DATO.json, o None si no tiene coordenadas."""
+    nombre_base = archivo.replace("_DATO.json", "")
+
+    try:
+        lat = datos.get("Lat")
+        lon = datos.get("Lon")
+        fecha = datos.get("Fecha", "")
+
+        if not lat or not lon:
+            return None  # saltar si no hay coordenadas
+
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [float(lon), float(lat)]
+            },
+            "properties": {
+                "archivo": nombre_base,
+                "thumbnail": f"{carpeta_icon_abs}/{nombre_base}_ICON.jpg",
+                "fecha": fecha
+            }
+        }
+    except Exception as e:
+        print(f"⚠️ Error con {archivo}: {e}")
+        return None
 
 def generar_geojson_thumbnails(carpeta_dato="Salida/Dato", carpeta_icon="Salida/Icon", salida_geojson="Salida/thumbnails.geojson"):
-    features = []
-
-    for archivo in os.listdir(carpeta_dato):
-        if not archivo.endswith("_DATO.json"):
-            continue
-
-        nombre_base = archivo.replace("_DATO.json", "")
-        ruta_json = os.path.join(carpeta_dato, archivo)
-        ruta_icon_relativa = os.path.join("Salida", "Icon", f"{nombre_base}_ICON.jpg").replace("\\", "/")
-        print(ruta_icon_relativa)
-        with open(ruta_json, 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-
-        try:
-            lat = datos.get("Lat")
-            lon = datos.get("Lon")
-            fecha = datos.get("Fecha", "")
-
-            if not lat or not lon:
-                continue  # saltar si no hay coordenadas
-
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [float(lon), float(lat)]
-                },
-                "properties": {
-                    "archivo": nombre_base,
-                    "thumbnail": os.path.abspath(os.path.join(ruta_icon_relativa)).replace("\\", "/")
-,
-                    "fecha": fecha
-                }
-            })
-        except Exception as e:
-            print(f"⚠️ Error con {archivo}: {e}")
-            continue
+    # scandir trae nombre y ruta de cada entrada sin stats extra
+    with os.scandir(carpeta_dato) as it:
+        entradas = [e for e in it if e.name.endswith("_DATO.json")]
+
+    # Muchos archivos chicos: la lectura es I/O y los threads sueltan el GIL en open/read
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        leidos = list(executor.map(_leer_json, entradas))
+
+    # Carpeta de íconos absoluta, una sola vez
+    carpeta_icon_abs = os.path.abspath(carpeta_icon).replace("\\", "/")
+
+    features = [
+        feature
+        for feature in (_armar_feature(archivo, datos, carpeta_icon_abs) for archivo, datos in leidos)
+        if feature is not None
+    ]
 
     geojson = {
         "type": "FeatureCollection",
@@ -46,8 +58,8 @@ def generar_geojson_thumbnails(carpeta_dato="Salida/Dato", carpeta_icon="Salida/
     }
 
     os.makedirs(os.path.dirname(salida_geojson), exist_ok=True)
-    with open(salida_geojson, 'w', encoding='utf-8') as f_out:
-        json.dump(geojson, f_out, indent=2, ensure_ascii=False)
+    with open(salida_geojson, 'wb') as f_out:
+        f_out.write(orjson.dumps(geojson, option=orjson.OPT_INDENT_2))
 
     print(f"✅ GeoJSON generado: {salida_geojson} (Total: {len(features)} puntos)")
 
@@ -5,6 +5,7 @@ import logging
 import re
 from typing import Tuple, Dict, Optional
 from datetime import datetime, timezone
+from functools import lru_cache
 from xml.etree import ElementTree as ET
 
 from PIL import Image, ExifTags
@@ -21,6 +22,30 @@ except Exception:
 
 logger = logging.getLogger("app")
 
+# El paquete XMP de un JPEG va en APP1, dentro de los primeros KB
+XMP_HEAD_BYTES = 256 * 1024
+
+# El APP1 (EXIF) está al principio del JPEG: exifread sólo necesita la cabecera
+EXIFREAD_HEAD_BYTES = 128 * 1024
+
+# Lado mínimo al decodificar con draft: libjpeg reduce 1/2, 1/4, 1/8 en la IDCT
+DRAFT_MIN_PX = 2048
+
+# Prefijo del APP1 que contiene el paquete XMP (el de EXIF empieza con b"Exif\0\0")
+XMP_APP1_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+
+# Comillas y corchetes que exifread deja alrededor de la terna de coordenadas
+_COORD_CLEAN_TBL = str.maketrans("", "", "'\"[]")
+
+
+@lru_cache(maxsize=16)
+def _load_exif_dict(exif_bytes: bytes) -> Dict:
+    """
+    piexif.load memoizado por bloque EXIF: extract_exif, la ruta GPS y
+    extract_captured_at comparten un único parseo. El dict es de sólo lectura.
+    """
+    return piexif.load(exif_bytes)
+
 
 class ImageService:
     # ---------------------------
@@ -37,7 +62,7 @@ class ImageService:
         try:
             exif_bytes = img.info.get("exif")
             if exif_bytes:
-                exif_dict = piexif.load(exif_bytes)
+                exif_dict = _load_exif_dict(exif_bytes)
                 for ifd in ("0th", "Exif", "GPS", "1st"):
                     for tag, val in (exif_dict.get(ifd, {}) or {}).items():
                         try:
@@ -83,8 +108,7 @@ class ImageService:
         Copiado de tu enfoque, con tolerancias extra.
         """
         try:
-            s = str(coord_str).strip().replace('"', '').replace("'", "").replace("[", "").replace("]", "")
-            partes = [p.strip() for p in s.split(",")]
+            partes = [p.strip() for p in str(coord_str).translate(_COORD_CLEAN_TBL).split(",")]
             if len(partes) < 2:
                 return None
             deg = float(partes[0])
@@ -120,15 +144,16 @@ class ImageService:
     @staticmethod
     def _extract_xmp_packet(data: bytes) -> Optional[str]:
         try:
-            m1 = re.search(br"<x:xmpmeta[^>]*>", data, re.IGNORECASE | re.DOTALL)
-            if not m1:
-                return None
-            start = m1.start()
-            m2 = re.search(br"</x:xmpmeta>", data[start:], re.IGNORECASE)
-            if not m2:
+            # find literal (memmem en C); el XMP va en APP1, así que primero solo la cabecera
+            start = data.find(b"<x:xmpmeta", 0, XMP_HEAD_BYTES)
+            if start == -1:
+                start = data.find(b"<x:xmpmeta")
+                if start == -1:
+                    return None
+            end = data.find(b"</x:xmpmeta>", start)
+            if end == -1:
                 return None
-            end = start + m2.end()
-            return data[start:end].decode("utf-8", errors="ignore")
+            return data[start:end + len(b"</x:xmpmeta>")].decode("utf-8", errors="ignore")
         except Exception:
             return None
 
@@ -194,13 +219,24 @@ class ImageService:
     # ---------------------------
     # GPS (rutas de extracción)
     # ---------------------------
+    @staticmethod
+    def _exifread_tags(original_bytes: bytes) -> Dict:
+        """
+        exifread sobre los primeros EXIFREAD_HEAD_BYTES; si el EXIF quedó cortado
+        (falta 'EXIF ExifVersion'), reintenta con el archivo completo.
+        """
+        tags = exifread.process_file(io.BytesIO(original_bytes[:EXIFREAD_HEAD_BYTES]), details=False)
+        if "EXIF ExifVersion" not in tags and len(original_bytes) > EXIFREAD_HEAD_BYTES:
+            tags = exifread.process_file(io.BytesIO(original_bytes), details=False)
+        return tags
+
     @staticmethod
     def _gps_from_exifread_bytes(original_bytes: bytes) -> Optional[Tuple[float, float]]:
         """
         Tu ruta preferida: exifread -> 'GPS GPSLatitude'/'GPS GPSLongitude' + convertir_coord().
         """
         try:
-            tags = exifread.process_file(io.BytesIO(original_bytes), details=False)
+            tags = ImageService._exifread_tags(original_bytes)
             lat = tags.get("GPS GPSLatitude")
             lon = tags.get("GPS GPSLongitude")
             lat_ref = tags.get("GPS GPSLatitudeRef")
@@ -223,7 +259,14 @@ class ImageService:
     @staticmethod
     def _gps_from_piexif_bytes(exif_bytes: bytes) -> Optional[Tuple[float, float]]:
         try:
-            exif_dict = piexif.load(exif_bytes)
+            return ImageService._gps_from_exif_dict(_load_exif_dict(exif_bytes))
+        except Exception:
+            logger.debug("_gps_from_piexif_bytes falló", exc_info=True)
+            return None
+
+    @staticmethod
+    def _gps_from_exif_dict(exif_dict: Dict) -> Optional[Tuple[float, float]]:
+        try:
             gps_ifd = exif_dict.get("GPS", {}) or {}
             lat = gps_ifd.get(piexif.GPSIFD.GPSLatitude)
             lat_ref = gps_ifd.get(piexif.GPSIFD.GPSLatitudeRef)
@@ -238,8 +281,73 @@ class ImageService:
             lon_dd = ImageService._dms_to_dd(d, m, s, lon_ref)
             return (lon_dd, lat_dd)
         except Exception:
-            logger.debug("_gps_from_piexif_bytes falló", exc_info=True)
+            logger.debug("_gps_from_exif_dict falló", exc_info=True)
+            return None
+
+    @staticmethod
+    def _captured_at_from_exif_dict(exif_dict: Dict) -> Optional[datetime]:
+        exif_ifd = exif_dict.get("Exif", {}) or {}
+        raw = exif_ifd.get(piexif.ExifIFD.DateTimeOriginal) or exif_ifd.get(piexif.ExifIFD.DateTimeDigitized)
+        if not raw:
+            raw = (exif_dict.get("0th", {}) or {}).get(piexif.ImageIFD.DateTime)
+        if not raw:
             return None
+        if isinstance(raw, bytes):
+            raw = raw.decode(errors="ignore")
+        dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
+        return dt.replace(tzinfo=timezone.utc)
+
+    # ---------------------------
+    # Recorrido único del JPEG
+    # ---------------------------
+    @staticmethod
+    def extract_all(data: bytes) -> Dict:
+        """
+        Recorre los segmentos del JPEG una sola vez (hasta SOS) y arma:
+        {"jpeg", "exif_dict", "xmp", "gps", "captured_at"}.
+        EXIF: piexif sobre el APP1 "Exif"; XMP: el APP1 de Adobe. Si no es un JPEG
+        recorrible, "jpeg" queda False y el resto en None.
+        """
+        out: Dict = {"jpeg": False, "exif_dict": None, "xmp": None, "gps": None, "captured_at": None}
+        if data[:2] != b"\xff\xd8":
+            return out
+
+        exif_seg = xmp_seg = None
+        p = 2
+        while p + 4 <= len(data):
+            if data[p] != 0xFF:
+                return out
+            marker = data[p + 1]
+            if marker == 0xFF:  # relleno entre segmentos
+                p += 1
+                continue
+            if marker == 0xDA:  # SOS: no hay más cabeceras
+                break
+            end = p + 2 + int.from_bytes(data[p + 2:p + 4], "big")
+            if marker == 0xE1:
+                payload = data[p + 4:end]
+                if exif_seg is None and payload.startswith(b"Exif\x00\x00"):
+                    exif_seg = payload
+                elif xmp_seg is None and payload.startswith(XMP_APP1_HEADER):
+                    xmp_seg = payload[len(XMP_APP1_HEADER):]
+            p = end
+        out["jpeg"] = True
+
+        if exif_seg:
+            try:
+                # Mismo bloque que Pillow expone en info["exif"]: comparte la caché de piexif
+                exif_dict = _load_exif_dict(exif_seg)
+                out["exif_dict"] = exif_dict
+                out["gps"] = ImageService._gps_from_exif_dict(exif_dict)
+                out["captured_at"] = ImageService._captured_at_from_exif_dict(exif_dict)
+            except Exception:
+                logger.debug("extract_all: piexif falló", exc_info=True)
+
+        if xmp_seg:
+            out["xmp"] = xmp_seg.decode("utf-8", errors="ignore")
+            if out["gps"] is None:
+                out["gps"] = ImageService._parse_xmp_gps(out["xmp"])
+        return out
 
     @staticmethod
     def extract_gps_from_original(original_bytes: bytes, compressed_img: Optional[Image.Image] = None) -> Optional[Tuple[float, float]]:
@@ -250,27 +358,38 @@ class ImageService:
         3) XMP embebido
         4) QuickTime ISO6709 (HEIC/Apple)
         5) EXIF de la imagen comprimida (último recurso)
+        Antes de eso, en un JPEG, un único recorrido (extract_all); solo se saltean
+        los backends que ese recorrido ya cubrió con éxito.
         """
-        # 1) exifread
-        gps = ImageService._gps_from_exifread_bytes(original_bytes)
-        if gps:
-            logger.debug("GPS desde exifread: %s", gps)
-            return gps
-
-        # 2) piexif: leer EXIF de los bytes originales si Pillow lo expone
-        try:
-            im0 = Image.open(io.BytesIO(original_bytes))
-            exif0 = im0.info.get("exif")
-        except Exception:
-            exif0 = None
-        if exif0:
-            gps = ImageService._gps_from_piexif_bytes(exif0)
+        parsed = ImageService.extract_all(original_bytes)
+        if parsed["gps"]:
+            logger.debug("GPS desde extract_all: %s", parsed["gps"])
+            return parsed["gps"]
+
+        # 1) exifread: si piexif ya parseó el EXIF (sin GPS) no hay nada más que ver ahí;
+        #    si no lo parseó (no es JPEG, o el EXIF está roto) exifread es más tolerante
+        if parsed["exif_dict"] is None:
+            gps = ImageService._gps_from_exifread_bytes(original_bytes)
             if gps:
-                logger.debug("GPS desde piexif (original): %s", gps)
+                logger.debug("GPS desde exifread: %s", gps)
                 return gps
 
-        # 3) XMP
-        xmp_xml = ImageService._extract_xmp_packet(original_bytes)
+        # 2) piexif: leer EXIF de los bytes originales si Pillow lo expone
+        #    (en un JPEG es el mismo APP1 que ya intentó extract_all)
+        if not parsed["jpeg"]:
+            try:
+                im0 = Image.open(io.BytesIO(original_bytes))
+                exif0 = im0.info.get("exif")
+            except Exception:
+                exif0 = None
+            if exif0:
+                gps = ImageService._gps_from_piexif_bytes(exif0)
+                if gps:
+                    logger.debug("GPS desde piexif (original): %s", gps)
+                    return gps
+
+        # 3) XMP fuera del APP1 estándar de Adobe: búsqueda en todo el buffer
+        xmp_xml = ImageService._extract_xmp_packet(original_bytes) if parsed["xmp"] is None else None
         if xmp_xml:
             gps = ImageService._parse_xmp_gps(xmp_xml)
             if gps:
@@ -284,6 +403,10 @@ class ImageService:
             return gps
 
         # 5) EXIF de la comprimida
+        return ImageService._gps_from_compressed(compressed_img)
+
+    @staticmethod
+    def _gps_from_compressed(compressed_img: Optional[Image.Image]) -> Optional[Tuple[float, float]]:
         if compressed_img is not None:
             try:
                 exif1 = compressed_img.info.get("exif")
@@ -310,23 +433,16 @@ class ImageService:
         try:
             exif_bytes = img.info.get("exif")
             if exif_bytes:
-                exif_dict = piexif.load(exif_bytes)
-                exif_ifd = exif_dict.get("Exif", {}) or {}
-                raw = exif_ifd.get(piexif.ExifIFD.DateTimeOriginal) or exif_ifd.get(piexif.ExifIFD.DateTimeDigitized)
-                if not raw:
-                    raw = (exif_dict.get("0th", {}) or {}).get(piexif.ImageIFD.DateTime)
-                if raw:
-                    if isinstance(raw, bytes):
-                        raw = raw.decode(errors="ignore")
-                    dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
-                    return dt.replace(tzinfo=timezone.utc)
+                dt = ImageService._captured_at_from_exif_dict(_load_exif_dict(exif_bytes))
+                if dt:
+                    return dt
         except Exception:
             logger.debug("extract_captured_at: piexif falló", exc_info=True)
 
         # 2) Fallback exifread sobre bytes originales
         if original_bytes:
             try:
-                tags = exifread.process_file(io.BytesIO(original_bytes), details=False)
+                tags = ImageService._exifread_tags(original_bytes)
                 raw = tags.get("EXIF DateTimeOriginal") or tags.get("Image DateTime")
                 if raw:
                     dt = datetime.strptime(str(raw)[:19], "%Y:%m:%d %H:%M:%S")
@@ -345,7 +461,10 @@ class ImageService:
         Convierte a JPEG preservando EXIF (si existía) y ajusta calidad hasta <= target_bytes.
         """
         img = Image.open(io.BytesIO(data))
-        img = img.convert("RGB")  # fuerza JPEG
+        if img.format == "JPEG":
+            img.draft("RGB", (DRAFT_MIN_PX, DRAFT_MIN_PX))
+        if img.mode != "RGB":
+            img = img.convert("RGB")  # fuerza JPEG
 
         # EXIF del original para preservarlo
         exif_preserve = None
@@ -356,17 +475,44 @@ class ImageService:
         except Exception:
             logger.debug("No pude obtener EXIF del original para preservarlo", exc_info=True)
 
-        quality = 92
-        step = 6
         out = io.BytesIO()
-        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True, exif=exif_preserve)
-        b = out.getvalue()
-
-        while len(b) > target_bytes and quality > 10:
-            quality = max(10, quality - step)
-            out = io.BytesIO()
-            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True, exif=exif_preserve)
-            b = out.getvalue()
+        best = None
+
+        def encode(buf: io.BytesIO, quality: int, final: bool = True) -> int:
+            # optimize/progressive (pasada extra de Huffman) solo si el encode se entrega
+            buf.seek(0)
+            buf.truncate()
+            if final:
+                img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True, exif=exif_preserve)
+            else:
+                img.save(buf, format="JPEG", quality=quality, exif=exif_preserve)
+            return buf.tell()  # tamaño sin copiar los bytes
+
+        # Intento directo a q=92; si no entra, bisección en [10, 91]
+        if encode(out, 92) <= target_bytes:
+            best = out
+        else:
+            lo, hi = 10, 91
+            best_q = None
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                if encode(out, mid, final=False) <= target_bytes:
+                    # El que entró queda como best; se intercambian buffers en vez de copiar
+                    best, out = out, (best if best is not None else io.BytesIO())
+                    best_q, lo = mid, mid + 1
+                else:
+                    hi = mid - 1
+            if best is not None:
+                # Encode final optimizado a la calidad elegida; si saliera más grande, queda el sondeo
+                if encode(out, best_q) <= best.tell():
+                    best = out
+            else:
+                # Ni a q=10 entra: se devuelve igual, como antes
+                encode(out, 10)
+                best = out
+
+        # Única materialización a bytes
+        b = best.getvalue()
 
         w, h = img.size
         return b, w, h, "image/jpeg"